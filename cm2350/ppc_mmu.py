@@ -343,6 +343,15 @@ class PpcMMU:
         self.emu.addSprWriteHandler(REG_L1CSR0, self._l1csr0WriteHandler)
         self.emu.addSprWriteHandler(REG_L1CSR1, self._l1csr1WriteHandler)
 
+        self.reset(emu)
+
+    def reset(self, emu):
+        '''
+        Invalidate all TLB entries and restore TLB1 entry 0 to its reset value
+        '''
+        for entry in self._tlb:
+            entry.config()
+
         # Set TLB1 entry 0 to the correct default values.
         #   (from "10.6.7 TLB load on reset" e200z759CRM.pdf page 570)
         #
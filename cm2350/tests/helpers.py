@@ -1,7 +1,10 @@
+import copy
 import gc
 import os
+import platform
 import queue
 import random
+import sys
 import unittest
 
 import envi.bits as e_bits
@@ -22,15 +25,88 @@ __all__ = [
 ]
 
 
+# Reverse lookup of PPC SPR names to SPR numbers, if there are duplicate names
+# the first SPR number defined wins (same as a linear search of eaps.sprs).
+_SPR_NAME_TO_NUM = {}
+for _num, (_name, _, _) in eaps.sprs.items():
+    _SPR_NAME_TO_NUM.setdefault(_name, _num)
+
+
+# MSR bits to set at the start of each test to enable all exceptions
+_MSR_ENABLE_MASK = eapc.MSR_EE_MASK | eapc.MSR_CE_MASK | eapc.MSR_ME_MASK | eapc.MSR_DE_MASK
+
+
+# The amount of random data to generate at once for test values
+_RAND_BUF_SIZE = 65536
+
+# Random test values of these sizes are converted with int.from_bytes()
+_NATIVE_INT_SIZES = (1, 2, 4, 8)
+
+# Freezing the existing objects before a test that disables the garbage
+# collector is only done on CPython
+_GC_TUNING = platform.python_implementation() == 'CPython'
+
+
+class _LazyMsg:
+    '''
+    Assertion message that is only formatted if the message is actually used
+    (when an assertion fails).
+    '''
+    __slots__ = ('fmt', 'args')
+
+    def __init__(self, fmt, *args):
+        self.fmt = fmt
+        self.args = args
+
+    def __str__(self):
+        return self.fmt % self.args
+
+
+# The exception and message description used to validate each type of invalid
+# memory access
+_MEM_EXC = {
+    ('read', 'bus'):    (intc_exc.MceDataReadBusError, 'invalid'),
+    ('read', 'align'):  (intc_exc.AlignmentException, 'unaligned'),
+    ('write', 'bus'):   (intc_exc.MceWriteBusError, 'invalid'),
+    ('write', 'align'): (intc_exc.AlignmentException, 'unaligned'),
+}
+
+
+# The LOG_LEVEL environment variable is only checked once, and each logger
+# only needs to be initialized once
+_LOG_LEVEL = os.environ.get('LOG_LEVEL')
+_initialized_loggers = set()
+
+
+# Any exceptions left pending at the end of a test are printed unless
+# EMU_PRINT_PENDING=0 is set
+_PRINT_PENDING = os.environ.get('EMU_PRINT_PENDING', '1') != '0'
+
+
+# Unfortunately python3.11 changed how the unittest module tracks failures so
+# the errors list must be retrieved differently based on the Python version.
+if sys.version_info >= (3, 11):
+    # How the Python 3.11+ unittest module tracks failures
+    def _getOutcomeErrors(outcome):
+        return outcome.result.errors
+else:
+    # How the Python 3.4 - 3.10 unittest module tracks failures
+    def _getOutcomeErrors(outcome):
+        return outcome.errors
+
+
 def initLogging(logobj):
-    log_lvl = os.environ.get('LOG_LEVEL')
-    if log_lvl:
-        if hasattr(logging, log_lvl):
-            e_common.initLogging(logobj, getattr(logging, log_lvl))
-        elif hasattr(e_common, log_lvl):
-            e_common.initLogging(logobj, getattr(e_common, log_lvl))
-        else:
-            raise Exception('Invalid log level: %s' % log_lvl)
+    if not _LOG_LEVEL or logobj.name in _initialized_loggers:
+        return
+
+    if hasattr(logging, _LOG_LEVEL):
+        e_common.initLogging(logobj, getattr(logging, _LOG_LEVEL))
+    elif hasattr(e_common, _LOG_LEVEL):
+        e_common.initLogging(logobj, getattr(e_common, _LOG_LEVEL))
+    else:
+        raise Exception('Invalid log level: %s' % _LOG_LEVEL)
+
+    _initialized_loggers.add(logobj.name)
 
 
 class MPC5674_Test(unittest.TestCase):
@@ -46,10 +122,105 @@ class MPC5674_Test(unittest.TestCase):
     #
     # If any of the specific performance settings are not None, the specific
     # performance setting will be used instead of the default.
+    #
+    # When _disable_gc is set the garbage collector is disabled for the entire
+    # test (including emulator creation) so collections can't affect timing
+    # measurements. On CPython all objects that exist before the test starts
+    # are frozen so the collection done after the test only has to scan the
+    # objects created during the test.
     accurate_timing = False
     _start_timebase_paused = None
     _disable_gc = None
 
+    # When set to True one emulator is created for all of the tests in a
+    # TestCase class instead of creating a new emulator for each test. At the
+    # start of each test the shared emulator's initial register values are
+    # restored and then the emulator is reset, which resets all peripherals
+    # (including the INTC, MCU INTC pending and active exceptions, the MMU TLB
+    # entries and the bitfield SPRs such as TCR, TSR and HID0) and disables
+    # the timebase.
+    #
+    # The saved register values are restored directly so any SPR write
+    # handlers are not called when they are restored. MSR is written normally
+    # by setUp() after the reset so the MSR handler runs.
+    #
+    # The following state is NOT restored between tests:
+    #   - flash contents
+    #   - the standby portion of SRAM (which is not cleared on reset)
+    #   - memory maps added by a test
+    #   - memory read/write callbacks and MCU INTC exception callbacks added
+    #     by a test
+    #   - any other attributes a test sets directly on the emulator or its
+    #     peripherals
+    #
+    # So this should only be enabled for tests that don't depend on any of the
+    # above starting out in the same state as a new emulator.
+    shared_emulator = False
+
+    # The sizes of random flash and RAM test values
+    _SIZES = (1, 2, 4)
+
+    # Minimal required configuration
+    _BASE_CONFIG = {
+        'project': {
+            'arch': 'ppc32-embedded',
+        },
+        'MPC5674': {
+            'FMPLL': {
+                'extal': 40000000,
+            },
+        },
+    }
+
+    @classmethod
+    def _createEmulator(cls):
+        logger.debug('Creating MPC5674 with args: %r', cls.args)
+
+        # Pass a copy of the base configuration so nothing that is done with
+        # the configuration while opening the project can change the base
+        # configuration used by other tests
+        config = copy.deepcopy(cls._BASE_CONFIG)
+        return MPC5674_Emulator(defconfig=config, args=cls.args)
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        # The flash and RAM regions are static attributes of the emulator
+        # class so the random address boundaries for them can be saved once
+        # for all tests instead of in each test instance.
+        cls._flash_start, cls._flash_end = MPC5674_Emulator.flash_mmaps[0]
+        cls._flash_words = (cls._flash_end - cls._flash_start) >> 2
+        cls._ram_start, cls._ram_end = MPC5674_Emulator.ram_mmaps[0]
+        cls._ram_words = (cls._ram_end - cls._ram_start) >> 2
+
+        if cls.shared_emulator:
+            initLogging(logger)
+            cls._emu = cls._createEmulator()
+
+            # Save the initial register values so they can be restored at the
+            # start of each test
+            cls._emu_regs = cls._emu.getRegisterSnap()
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.shared_emulator and hasattr(cls, '_emu'):
+            cls._emu.shutdown()
+            del cls._emu
+            del cls._emu_regs
+
+        super().tearDownClass()
+
+    def _setUpEmulator(self):
+        if self.shared_emulator:
+            # Restore the initial register values and then reset the shared
+            # emulator (see the shared_emulator option)
+            self.emu = self._emu
+            self.emu.setRegisterSnap(self._emu_regs)
+            self.emu.reset()
+        else:
+            self.emu = self._createEmulator()
+
     def setUp(self):
         initLogging(logger)
 
@@ -58,43 +229,55 @@ class MPC5674_Test(unittest.TestCase):
         if self._disable_gc is None:
             self._disable_gc = True if self.accurate_timing else False
 
-        logger.debug('Creating MPC5674 with args: %r', self.args)
+        # Check if the garbage collector should be disabled for these tests.
+        # The normal garbage collector settings are restored with a cleanup
+        # function so they are restored even if setUp() fails.
+        if self._disable_gc:
+            if _GC_TUNING:
+                gc.freeze()
+            gc.disable()
+            self.addCleanup(self._restoreGC)
 
-        # Minimal required configuration
-        config = {
-            'project': {
-                'arch': 'ppc32-embedded',
-            },
-            'MPC5674': {
-                'FMPLL': {
-                    'extal': 40000000,
-                },
-            },
-        }
+        self._setUpEmulator()
 
-        self.emu = MPC5674_Emulator(defconfig=config, args=self.args)
+        self._update_mem_map_cache()
 
-        # Check if the garbage collector should be disabled for these tests
-        if self._disable_gc:
-            gc.disable()
+        # The emulator endianness doesn't change
+        self._bigend = bool(self.emu.getEndian())
+        self._endian_str = 'big' if self._bigend else 'little'
+
+        # Per-test values that depend on the emulator instance or that should
+        # not be shared between tests are instance attributes, invariants are
+        # saved on the class in setUpClass().
+        #
+        # Each test uses its own random number generator
+        self._rng = random.Random()
+
+        # Buffer of random data to use for test values, it is filled the first
+        # time random data is needed so tests that don't use random values
+        # don't have to generate it
+        self._rand_buf = b''
+        self._rand_pos = 0
 
         # Set the INTC[CPR] to 0 to allow all peripheral (external) exception
         # priorities to happen
         self.emu.intc.registers.cpr.pri = 0
-        msr_val = self.emu.getRegister(eapr.REG_MSR)
 
         # Enable all possible Exceptions so if anything happens it will be
         # detected by the _getPendingExceptions utility
-        msr_val |= eapc.MSR_EE_MASK | eapc.MSR_CE_MASK | eapc.MSR_ME_MASK | eapc.MSR_DE_MASK
-        self.emu.setRegister(eapr.REG_MSR, msr_val)
+        self.emu.setRegister(eapr.REG_MSR, self.emu.getRegister(eapr.REG_MSR) | _MSR_ENABLE_MASK)
 
         # Enable the timebase (normally done by writing a value to HID0)
         if not self._start_timebase_paused:
             self.emu.enableTimebase()
 
     def _getPendingExceptions(self):
-        # Remove all the exceptions in the pending list
+        # Remove all the exceptions in the pending list, if there are no
+        # pending exceptions the existing (empty) list doesn't need to be
+        # replaced.
         pending = self.emu.mcu_intc.pending
+        if not pending:
+            return []
         self.emu.mcu_intc.pending = []
         return pending
 
@@ -103,161 +286,182 @@ class MPC5674_Test(unittest.TestCase):
         return self.emu.mcu_intc.pending
 
     def tearDown(self):
-        # Ensure that there are no unprocessed exceptions
-        pending_excs = self._getPendingExceptions()
-        for exc in pending_excs:
-            print('Unhanded PPC Exception %s' % exc)
-
-        # Only assert if the test is current succeeding, we don't want to 
-        # override the error of a failure, the success attribute isn't set yet, 
-        # instead look at the errors attribute.
-        #
-        # Unfortunately python3.11 changed how to check this so we have to check 
-        # for the existence of the 'errors' attribute on the TestCase.outcome 
-        # object, and if that attribute doesn't exist get the errors list from 
-        # the result object.
-
-        # How the Python 3.4 - 3.10 unittest module tracks failures
-        if hasattr(self._outcome, 'errors'):
-            if not self._outcome.errors:
+        # Ensure that there are no unprocessed exceptions, the pending list
+        # only needs to be drained when it isn't empty.
+        if self.emu.mcu_intc.pending:
+            pending_excs = self._getPendingExceptions()
+            if _PRINT_PENDING:
+                sys.stderr.write('Unhandled PPC Exceptions:\n' +
+                        '\n'.join(map(str, pending_excs)) + '\n')
+
+            # Only assert if the test is current succeeding, we don't want to 
+            # override the error of a failure, the success attribute isn't set 
+            # yet, instead look at the errors attribute.
+            if not _getOutcomeErrors(self._outcome):
                 self.assertEqual(pending_excs, [])
 
-        # How the Python 3.11+ unittest module tracks failures
-        elif not self._outcome.result.errors:
-            self.assertEqual(pending_excs, [])
-
-        # Clean up the resources
-        self.emu.shutdown()
+        # Clean up the resources, a shared emulator is cleaned up in
+        # tearDownClass()
+        if not self.shared_emulator:
+            self.emu.shutdown()
         del self.emu
 
-        # Re-enable the garbage collector if it was disabled and force memory
-        # cleanup now
-        if self._disable_gc:
-            gc.enable()
-            gc.collect()
+    def _restoreGC(self):
+        # Cleanup function (run after tearDown()) to force memory cleanup now
+        # and re-enable the garbage collector.
+        #
+        # The collection is done before unfreezing so only the objects created
+        # during the test (including the emulator created by setUp()) are
+        # scanned, the objects frozen by setUp() are ignored.
+        gc.collect()
+        if _GC_TUNING:
+            gc.unfreeze()
+        gc.enable()
 
     ##################################################
     # Helper utility functions
     ##################################################
 
+    def _update_mem_map_cache(self):
+        # The memory map used to generate random PC values doesn't change
+        # during a test so save the boundaries now instead of looking them up
+        # every time a random address is needed. If a test does change the
+        # memory maps this should be called again.
+        #
+        # The flash and RAM boundaries are saved in setUpClass().
+        self._pc_start, self._pc_end, _, _ = self.emu.getMemoryMap(0)
+        self._pc_words = (self._pc_end - self._pc_start) >> 2
+
+    def _random_word_addr(self, start, words):
+        '''
+        Return a random 4-byte aligned address that is within "words" 4-byte
+        words of the "start" address.
+        '''
+        if words & (words - 1):
+            return start + ((self._rng.getrandbits(32) % words) << 2)
+        else:
+            # Power of two word count, the offset can just be masked
+            return start + ((self._rng.getrandbits(32) & (words - 1)) << 2)
+
     def get_random_pc(self):
-        start, end, perms, filename = self.emu.getMemoryMap(0)
-        return random.randrange(start, end, 4)
+        return self._random_word_addr(self._pc_start, self._pc_words)
 
     def set_random_pc(self):
         test_pc = self.get_random_pc()
         self.emu.setProgramCounter(test_pc)
         return test_pc
 
+    def _next_rand(self, size):
+        # Return the next "size" bytes of random data, if there isn't enough
+        # left in the buffer generate a new block of random data
+        pos = self._rand_pos
+        if pos + size > len(self._rand_buf):
+            self._rand_buf = os.urandom(max(size, _RAND_BUF_SIZE))
+            pos = 0
+        self._rand_pos = pos + size
+        return self._rand_buf[pos:pos + size]
+
     def get_random_val(self, size):
-        val_bytes = os.urandom(size)
-        val = e_bits.parsebytes(val_bytes, 0, size, bigend=self.emu.getEndian())
+        val_bytes = self._next_rand(size)
+        if size in _NATIVE_INT_SIZES:
+            val = int.from_bytes(val_bytes, self._endian_str)
+        else:
+            val = e_bits.parsebytes(val_bytes, 0, size, bigend=self._bigend)
         return (val, val_bytes)
 
     def get_random_flash_addr_and_data(self):
-        start, end = self.emu.flash_mmaps[0]
-        addr = random.randrange(start, end, 4)
+        addr = self._random_word_addr(self._flash_start, self._flash_words)
 
         # Determine write size and generate some data
-        size = random.choice((1, 2, 4))
+        size = self._rng.choice(self._SIZES)
         value, _ = self.get_random_val(size)
 
         return (addr, value, size)
 
     def get_random_ram_addr_and_data(self):
-        start, end = self.emu.ram_mmaps[0]
-        addr = random.randrange(start, end, 4)
+        addr = self._random_word_addr(self._ram_start, self._ram_words)
 
         # Determine write size and generate some data
-        size = random.choice((1, 2, 4))
+        size = self._rng.choice(self._SIZES)
         value, _ = self.get_random_val(size)
 
         return (addr, value, size)
 
-    def validate_invalid_read(self, addr, size, data=None, msg=None):
+    def _validate_mem_exc(self, op, kind, addr, size, data=None, written=0, msg=None):
         '''
-        For testing addresses that raise a bus error on read
+        Perform a read or write ("op") of "addr" and confirm that the type of
+        exception identified by "kind" is raised with the correct address, PC
+        and data values.
         '''
+        exc_type, desc = _MEM_EXC[op, kind]
         pc = self.set_random_pc()
 
-        if data is None:
-            data = b''
-
-        if msg is None:
-            msg = 'invalid read from 0x%x' % (addr)
+        if op == 'read':
+            if data is None:
+                data = b''
+            expected_data = data
+            fmt = '%s read from 0x%x'
+            args = (desc, addr)
         else:
-            msg = 'invalid read from 0x%x (%s)' % (addr, msg)
+            if kind == 'bus':
+                value, data = self.get_random_val(size)
+            elif data is None:
+                data = self._next_rand(size)
+            expected_data = data[:written]
+            fmt = '%s write of %r to 0x%x'
+            args = (desc, data, addr)
+
+        if msg is not None:
+            fmt += ' (%s)'
+            args += (msg,)
+        msg = _LazyMsg(fmt, *args)
+
+        # A plain try/except is used instead of the assertRaises() context
+        # manager because this is called many times in some tests. Any
+        # exceptions other than the expected type are not caught.
+        try:
+            if op == 'read':
+                self.emu.readMemValue(addr, size)
+            elif kind == 'bus':
+                self.emu.writeMemValue(addr, value, size)
+            else:
+                self.emu.writeMemory(addr, data)
+        except exc_type as e:
+            # Only keep the exception kwargs, keeping the exception would
+            # create a reference cycle through its traceback and this frame
+            kwargs = e.kwargs
+        else:
+            self.fail(self._formatMessage(msg, '%s not raised' % exc_type.__name__))
 
-        with self.assertRaises(intc_exc.MceDataReadBusError, msg=msg) as cm:
-            self.emu.readMemValue(addr, size)
+        self.assertEqual(kwargs['va'], addr, msg=msg)
+        self.assertEqual(kwargs['pc'], pc, msg=msg)
+        self.assertEqual(kwargs['data'], expected_data, msg=msg)
 
-        self.assertEqual(cm.exception.kwargs['va'], addr, msg=msg)
-        self.assertEqual(cm.exception.kwargs['pc'], pc, msg=msg)
-        self.assertEqual(cm.exception.kwargs['data'], data, msg=msg)
+    def validate_invalid_read(self, addr, size, data=None, msg=None):
+        '''
+        For testing addresses that raise a bus error on read
+        '''
+        self._validate_mem_exc('read', 'bus', addr, size, data=data, msg=msg)
 
     def validate_unaligned_read(self, addr, size, data=None, msg=None):
         '''
         For testing addresses that raise an alignment error on read
         '''
-        pc = self.set_random_pc()
-
-        if data is None:
-            data = b''
-
-        if msg is None:
-            msg = 'unaligned read from 0x%x' % (addr)
-        else:
-            msg = 'unaligned read from 0x%x (%s)' % (addr, msg)
-
-        with self.assertRaises(intc_exc.AlignmentException, msg=msg) as cm:
-            self.emu.readMemValue(addr, size)
-
-        self.assertEqual(cm.exception.kwargs['va'], addr, msg=msg)
-        self.assertEqual(cm.exception.kwargs['pc'], pc, msg=msg)
-        self.assertEqual(cm.exception.kwargs['data'], data, msg=msg)
+        self._validate_mem_exc('read', 'align', addr, size, data=data, msg=msg)
 
     def validate_invalid_write(self, addr, size, written=0, msg=None):
         '''
         For testing addresses that raise a bus error on write (like read-only
         memory locations)
         '''
-        pc = self.set_random_pc()
-        value, value_bytes = self.get_random_val(size)
-
-        if msg is None:
-            msg = 'unaligned write of %r to 0x%x' % (value_bytes, addr)
-        else:
-            msg = 'unaligned write of %r to 0x%x (%s)' % (value_bytes, addr, msg)
-
-        with self.assertRaises(intc_exc.MceWriteBusError, msg=msg) as cm:
-            self.emu.writeMemValue(addr, value, size)
-
-        self.assertEqual(cm.exception.kwargs['va'], addr, msg=msg)
-        self.assertEqual(cm.exception.kwargs['pc'], pc, msg=msg)
-        self.assertEqual(cm.exception.kwargs['data'], value_bytes[:written], msg=msg)
+        self._validate_mem_exc('write', 'bus', addr, size, written=written, msg=msg)
 
     def validate_unaligned_write(self, addr, size=0, data=None, written=0, msg=None):
         '''
         For testing addresses that raise an unaligned on write.
         '''
-        pc = self.set_random_pc()
-
         assert size or data
-
-        if data is None:
-            data = os.urandom(size)
-
-        if msg is None:
-            msg = 'invalid write of %r to 0x%x' % (data, addr)
-        else:
-            msg = 'invalid write of %r to 0x%x (%s)' % (data, addr, msg)
-
-        with self.assertRaises(intc_exc.AlignmentException, msg=msg) as cm:
-            self.emu.writeMemory(addr, data)
-
-        self.assertEqual(cm.exception.kwargs['va'], addr, msg=msg)
-        self.assertEqual(cm.exception.kwargs['pc'], pc, msg=msg)
-        self.assertEqual(cm.exception.kwargs['data'], data[:written], msg=msg)
+        self._validate_mem_exc('write', 'align', addr, size, data=data, written=written, msg=msg)
 
     def validate_invalid_addr(self, addr, size, msg=None):
         '''
@@ -275,7 +479,7 @@ class MPC5674_Test(unittest.TestCase):
         '''
         pc = self.set_random_pc()
 
-        msg = 'Read unimplemented memory @ 0x%08x' % addr
+        msg = _LazyMsg('Read unimplemented memory @ 0x%08x', addr)
         with self.assertRaises(ppc_vstructs.VStructUnimplementedError, msg=msg) as cm:
             self.emu.readMemValue(addr, size)
 
@@ -285,7 +489,7 @@ class MPC5674_Test(unittest.TestCase):
         self.assertEqual(cm.exception.kwargs['size'], size)
 
         val, val_bytes = self.get_random_val(size)
-        msg = 'Write unimplemented memory @ 0x%08x' % addr
+        msg = _LazyMsg('Write unimplemented memory @ 0x%08x', addr)
         with self.assertRaises(ppc_vstructs.VStructUnimplementedError, msg=msg) as cm:
             self.emu.writeMemValue(addr, val, size)
 
@@ -295,43 +499,36 @@ class MPC5674_Test(unittest.TestCase):
         self.assertEqual(cm.exception.kwargs['size'], size)
 
     def get_spr_num(self, reg):
-        regname = self.emu.getRegisterName(reg)
-        return next(num for num, (name, _, _) in eaps.sprs.items() if name == regname)
+        return _SPR_NAME_TO_NUM[self.emu.getRegisterName(reg)]
 
     def assert_timer_within_range(self, value, expected, margin, maxval=0xFFFFFFFF, msg=None):
-        compare_msg = '%d =? %d +/- %d' % (value, expected, margin)
-        if msg is None:
-            msg = ''
-        else:
-            msg = ' (' + msg + ')'
-
-        logger.debug(msg)
-        if value < expected:
-            # See if perhaps the value just wrapped around, otherwise do the 
-            # normal margin check
-            if (maxval + value <= expected + margin) or value >= expected - margin:
-                result = True
-                extra = ' (max: %d)' % maxval
+        if logger.isEnabledFor(logging.DEBUG):
+            if msg is None:
+                logger.debug('%d =? %d +/- %d', value, expected, margin)
             else:
-                result = False
-                toobig_diff = (maxval + value) - (expected + margin)
-                toosmall_diff = (expected - margin) - value
-                if toosmall_diff < toobig_diff:
-                    extra = ' (max: %d, diff:%d)' % (maxval, -toosmall_diff)
-                else:
-                    extra = ' (max: %d, diff:%d)' % (maxval, toobig_diff)
-
-        else:
-            # It should be less than expected plus the margin
-            if value <= expected + margin:
-                result = True
-                extra = ' (max: %#x)' % maxval
-            else:
-                result = False
-                diff = value - (expected + margin)
-                extra = ' (max: %d, diff:%d)' % (maxval, diff)
-
-        if result:
-            self.assertTrue(result, msg=compare_msg+extra+msg)
-        else:
-            self.fail(msg=compare_msg+extra+msg)
+                logger.debug('%d =? %d +/- %d (%s)', value, expected, margin, msg)
+
+        diff = value - expected
+        if abs(diff) <= margin:
+            return
+
+        # If both values are valid timer values check if the timer value has
+        # wrapped around by comparing the difference modulo the timer range.
+        # Values wider than the timer (such as a 64-bit timebase) are only
+        # compared directly.
+        if 0 <= value <= maxval and 0 <= expected <= maxval:
+            span = maxval + 1
+            diff %= span
+            if diff <= margin or diff >= span - margin:
+                return
+
+            # Report the smaller of the two differences
+            if diff > span // 2:
+                diff -= span
+
+        # The comparison message is only created if the check fails
+        compare_msg = '%d =? %d +/- %d (max: %#x, diff:%d)' % \
+                (value, expected, margin, maxval, diff)
+        if msg is not None:
+            compare_msg += ' (' + msg + ')'
+        self.fail(msg=compare_msg)
@@ -0,0 +1,137 @@
+import unittest
+
+import envi.archs.ppc.regs as eapr
+
+from .. import intc_exc
+from ..intc_const import INTC_LEVEL_NONE
+
+from .helpers import MPC5674_Test
+
+
+# An address that is not mapped by any of the default (BAM) TLB entries
+UNMAPPED_VA = 0x80000000
+
+
+class MPC5674_SharedEmulator_Test(MPC5674_Test):
+    shared_emulator = True
+    _start_timebase_paused = True
+
+    def check_and_modify_state(self):
+        # Both tests in this class call this function so regardless of which
+        # test runs first the second test confirms that nothing modified by
+        # the first test is still set.
+
+        # Registers
+        self.assertEqual(self.emu.getRegister(eapr.REG_R3), 0)
+        self.assertEqual(self.emu.getRegister(eapr.REG_SPRG0), 0)
+
+        # TLB state
+        self.assertEqual(self.emu.mmu._tlb[5].valid, 0)
+        self.assertEqual(self.emu.mmu.tlbFindEntry(UNMAPPED_VA), None)
+
+        # Pending and active exceptions
+        self.assertEqual(self.emu.mcu_intc.pending, [])
+        self.assertEqual(self.emu.mcu_intc.stack, [])
+        self.assertEqual(self.emu.mcu_intc.curlvl, INTC_LEVEL_NONE)
+        self.assertFalse(self.emu.isExceptionActive(intc_exc.DecrementerException))
+
+        # Timebase
+        self.assertFalse(self.emu.timebaseRunning())
+        self.assertEqual(self.emu.getTimebase(), 0)
+
+        # Now change all of the above
+        self.emu.setRegister(eapr.REG_R3, 0x12345678)
+        self.emu.setRegister(eapr.REG_SPRG0, 0x87654321)
+
+        self.emu.mmu.tlbConfig(5, epn=UNMAPPED_VA, rpn=UNMAPPED_VA)
+        self.assertEqual(self.emu.mmu.tlbFindEntry(UNMAPPED_VA), self.emu.mmu._tlb[5])
+
+        # Queue an exception and start processing it so it is active rather
+        # than pending (a pending exception would fail in tearDown)
+        self.emu.queueException(intc_exc.DecrementerException())
+        self.emu.mcu_intc.checkException()
+        self.assertEqual(self.emu.mcu_intc.pending, [])
+        self.assertTrue(self.emu.isExceptionActive(intc_exc.DecrementerException))
+
+        self.emu.enableTimebase()
+        self.assertTrue(self.emu.timebaseRunning())
+
+    def test_shared_emulator_1(self):
+        self.check_and_modify_state()
+
+    def test_shared_emulator_2(self):
+        self.check_and_modify_state()
+
+    def test_shared_emulator_same_instance(self):
+        self.assertIs(self.emu, type(self)._emu)
+
+
+class MPC5674_TimerRange_Test(unittest.TestCase):
+    # assert_timer_within_range() doesn't use the emulator so it can be tested
+    # without creating one
+    assert_timer_within_range = MPC5674_Test.assert_timer_within_range
+
+    def assert_in_range(self, value, expected, margin, **kwargs):
+        self.assert_timer_within_range(value, expected, margin, **kwargs)
+
+    def assert_not_in_range(self, value, expected, margin, **kwargs):
+        with self.assertRaises(self.failureException):
+            self.assert_timer_within_range(value, expected, margin, **kwargs)
+
+    def test_exact_match(self):
+        self.assert_in_range(1000, 1000, 0)
+        self.assert_in_range(0, 0, 0)
+        self.assert_in_range(0xFFFFFFFF, 0xFFFFFFFF, 0)
+
+    def test_margin(self):
+        # Just inside the margin on each side
+        self.assert_in_range(995, 1000, 5)
+        self.assert_in_range(1005, 1000, 5)
+
+        # Just outside the margin on each side
+        self.assert_not_in_range(994, 1000, 5)
+        self.assert_not_in_range(1006, 1000, 5)
+
+    def test_wrap(self):
+        # The value has wrapped around past maxval but the expected value
+        # hasn't
+        self.assert_in_range(2, 0xFFFFFFFE, 5)
+        self.assert_not_in_range(4, 0xFFFFFFFE, 5)
+
+        # The expected value has wrapped around past maxval but the value
+        # hasn't
+        self.assert_in_range(0xFFFFFFFE, 2, 5)
+        self.assert_not_in_range(0xFFFFFFFC, 2, 5)
+
+        # maxval to 0 is one tick
+        self.assert_not_in_range(0, 0xFFFFFFFF, 0)
+        self.assert_in_range(0, 0xFFFFFFFF, 1)
+
+    def test_wider_than_maxval(self):
+        # Values wider than maxval (such as a 64-bit timebase compared with
+        # the default maxval) are not compared modulo maxval
+        self.assert_in_range(0x100000010, 0x100000000, 100)
+        self.assert_in_range(0x100000000, 0x100000010, 100)
+        self.assert_not_in_range(0x100000100, 0x100000000, 100)
+        self.assert_not_in_range(0x200000010, 0x100000010, 100)
+        self.assert_not_in_range(0x10, 0x100000010, 100)
+        self.assert_not_in_range(0x100000010, 0x10, 100)
+
+    def test_16bit_float_margin(self):
+        # Similar to how the FlexCAN timer tests use this function
+        self.assert_in_range(0x1000, 0x1000, 0.5, maxval=0xFFFF)
+        self.assert_in_range(0x1015, 0x1000, 21.5, maxval=0xFFFF)
+        self.assert_not_in_range(0x1016, 0x1000, 21.5, maxval=0xFFFF)
+        self.assert_in_range(0x0FEB, 0x1000, 21.5, maxval=0xFFFF)
+        self.assert_not_in_range(0x0FEA, 0x1000, 21.5, maxval=0xFFFF)
+
+        # Wrap in each direction
+        self.assert_in_range(0x0005, 0xFFF0, 21.5, maxval=0xFFFF)
+        self.assert_not_in_range(0x0006, 0xFFF0, 21.5, maxval=0xFFFF)
+        self.assert_in_range(0xFFF0, 0x0003, 19.5, maxval=0xFFFF)
+        self.assert_not_in_range(0xFFEF, 0x0003, 19.5, maxval=0xFFFF)
+
+    def test_failure_msg(self):
+        with self.assertRaises(self.failureException) as cm:
+            self.assert_timer_within_range(0xFFF0, 0x0010, 5, maxval=0xFFFF, msg='test')
+        self.assertEqual(str(cm.exception), '65520 =? 16 +/- 5 (max: 0xffff, diff:-32) (test)')
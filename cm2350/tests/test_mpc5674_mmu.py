@@ -2,7 +2,6 @@ import random
 import unittest
 
 import envi.bits as e_bits
-import envi.archs.ppc.spr as eaps
 import envi.archs.ppc.regs as eapr
 import envi.archs.ppc.const as eapc
 
@@ -219,10 +218,6 @@ class MPC5674_MMU_Test(MPC5674_Test):
     # UTILITIES
     ##################################################
 
-    def get_spr_num(self, reg):
-        regname = self.emu.getRegisterName(reg)
-        return next(num for num, (name, _, _) in eaps.sprs.items() if name == regname)
-
     def mfspr(self, spr, reg=eapr.REG_R3):
         # Get the actual PPC SPR number
         ppcspr = self.get_spr_num(spr)